@@ -1,4 +1,4 @@
-import uuid
+import json
 
 import math
 
@@ -6,11 +6,19 @@ from dataclasses import dataclass
 
 from typing import Dict, List, Tuple, Optional
  
+import numpy as np
+
 import streamlit as st
 
 import folium
 
-from streamlit_folium import st_folium
+from folium.plugins import FastMarkerCluster
+
+from scipy.spatial import cKDTree
+
+from streamlit_folium import generate_leaflet_string, st_folium
+ 
+from haversine_numba import perimeter
  
  
 # -----------------------------
@@ -35,6 +43,14 @@ PALETTE = [
 
 ]
  
+# Числовые коды типов (0..5) — в Numba-ядро передаём только числа
+
+TYPE_NAMES = [item["type"] for item in PALETTE]
+
+TYPE_CODES = {t: i for i, t in enumerate(TYPE_NAMES)}
+
+EMOJI_BY_TYPE = {item["type"]: item["emoji"] for item in PALETTE}
+ 
 DEFAULT_PARAMS = {
 
     "Жилой комплекс": {"residents": 1500},
@@ -72,11 +88,25 @@ MAP_STYLE = {
 # Центр Усть-Каменогорска (Өскемен)
 
 DEFAULT_CENTER = (49.9483, 82.6285)
+
+MAP_ZOOM_START = 13
  
 # Радиус анализа инфраструктуры вокруг точки (км)
 
 ANALYSIS_RADIUS_KM = 1.5
  
+# Сколько ближайших объектов показываем в анализе периметра
+
+NEAREST_SHOWN = 6
+ 
+# Равнопромежуточная проекция вокруг центра города: на расстояниях в пару км
+
+# расхождение с haversine — доли метра, а тригонометрия не нужна
+
+KM_PER_DEG = 111.195
+
+COS_PHI0 = math.cos(math.radians(DEFAULT_CENTER[0]))
+ 
  
 # -----------------------------
 
@@ -97,37 +127,130 @@ class CityObject:
     lon: float
 
     params: Dict
+
+    index_in_bucket: int = -1  # позиция в st.session_state.objects_by_type[obj_type]
  
  
 def new_id() -> str:
 
-    return uuid.uuid4().hex[:10]
+    # уникальность нужна только в пределах сессии — хватает счётчика
+
+    st.session_state.next_id += 1
+
+    return f"o{st.session_state.next_id:x}"
+ 
  
  
-def haversine_km(lat1, lon1, lat2, lon2) -> float:
+# Объекты в виде структурированного массива NumPy (одна запись на объект, в порядке списка);
+
+# float32 даёт ~0.5 м по координатам — с запасом для порогов в сотни метров
+
+OBJ_DTYPE = np.dtype([
+
+    ("id", "<U10"),
 
-    R = 6371.0
+    ("type_code", "<i1"),
 
-    p1, p2 = math.radians(lat1), math.radians(lat2)
+    ("lat", "<f4"),
 
-    dphi = math.radians(lat2 - lat1)
+    ("lon", "<f4"),
 
-    dl = math.radians(lon2 - lon1)
+    # тригонометрия по объекту считается один раз — при добавлении/перемещении
 
-    a = math.sin(dphi / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    ("lat_rad", "<f4"),
 
-    return 2 * R * math.asin(math.sqrt(a))
+    ("lon_rad", "<f4"),
+
+    ("cos_lat", "<f4"),
+
+    ("emission_eff", "<f4"),
+
+])
  
  
-def emoji_for_type(t: str) -> str:
+def object_record(o: CityObject) -> Tuple:
+
+    emission_eff = (
+
+        float(o.params.get("emission", 0)) * (1.0 - float(o.params.get("filters_eff", 0)))
+
+        if o.obj_type == "Промышленный объект" else 0.0
+
+    )
+
+    lat_rad, lon_rad = math.radians(o.lat), math.radians(o.lon)
+
+    return (o.id, TYPE_CODES[o.obj_type], o.lat, o.lon, lat_rad, lon_rad, math.cos(lat_rad), emission_eff)
+ 
+ 
+# -----------------------------
+
+# Spatial index (cKDTree)
+
+# -----------------------------
+
+def project_km(lat, lon):
+
+    # равнопромежуточная проекция (км): x = φ·KM_PER_DEG, y = λ·KM_PER_DEG·cos(φ0)
+
+    return KM_PER_DEG * lat, KM_PER_DEG * COS_PHI0 * lon
+ 
+ 
+def build_spatial_index(objs: List[CityObject], buckets: Dict[str, List[CityObject]], arrs: np.ndarray) -> Dict:
+
+    xy = np.column_stack(project_km(arrs["lat"].astype(np.float64), arrs["lon"].astype(np.float64)))
+
+    pos = {o.id: i for i, o in enumerate(objs)}
+ 
+    # координаты по каждой корзине типа (в порядке корзины) — для nearest_dist()
+
+    by_type = {
+
+        t: xy[np.array([pos[o.id] for o in bucket], dtype=np.intp)]
+
+        for t, bucket in buckets.items()
+
+    }
+ 
+    return {
+
+        "objs": objs,
+
+        "arrs": arrs,
 
-    for item in PALETTE:
+        "tree": cKDTree(xy),
 
-        if item["type"] == t:
+        "by_type": by_type,
 
-            return item["emoji"]
+        "pos": pos,
 
-    return "📍"
+        # записи массива целиком описывают всё, что читают расчёты, — это и есть ключ для st.cache_data
+
+        "key": arrs.tobytes(),
+
+    }
+ 
+ 
+def spatial_index(objs: List[CityObject]) -> Dict:
+
+    # индекс живёт в сессии и пересобирается только после изменения объектов
+
+    index = st.session_state.kdtree
+
+    if index is None or index["version"] != st.session_state.objects_version or index["objs"] is not objs:
+
+        index = build_spatial_index(objs, st.session_state.objects_by_type, st.session_state.obj_arr)
+
+        index["version"] = st.session_state.objects_version
+
+        st.session_state.kdtree = index
+
+    return index
+ 
+ 
+def emoji_for_type(t: str) -> str:
+
+    return EMOJI_BY_TYPE.get(t, "📍")
  
  
 # -----------------------------
@@ -136,11 +259,11 @@ def emoji_for_type(t: str) -> str:
 
 # -----------------------------
 
-def inject_css():
+# стили задаются одной строкой на уровне модуля; st.markdown всё равно нужен на каждом
 
-    st.markdown(
+# прогоне — Streamlit убирает элементы, которые скрипт не вывел заново
 
-        """
+CSS = """
 <style>
 
         .stApp { background: #fbfbfc; }
@@ -190,11 +313,12 @@ def inject_css():
         }
 </style>
 
-        """,
-
-        unsafe_allow_html=True
+        """
+ 
+ 
+def inject_css():
 
-    )
+    st.markdown(CSS, unsafe_allow_html=True)
  
  
 # -----------------------------
@@ -203,151 +327,215 @@ def inject_css():
 
 # -----------------------------
 
-def evaluate_location(obj_type: str, lat: float, lon: float, objs: List[CityObject]) -> Tuple[List[str], List[str]]:
+# Правила оценки места: (тип соседа, порог км, если ближе порога, если дальше, если соседа нет).
 
-    plus, minus = [], []
- 
-    def nearest_dist(t: str):
+# Исход — пара (плюс, минус), None = без сообщения; "если соседа нет" = None → как "дальше".
 
-        candidates = [o for o in objs if o.obj_type == t]
+# Тип соседа None — безусловное правило (всегда исход "ближе").
 
-        if not candidates:
+RULES = {
 
-            return None
+    "Жилой комплекс": (
 
-        return min(haversine_km(lat, lon, o.lat, o.lon) for o in candidates)
- 
-    near_home = nearest_dist("Жилой комплекс")
+        ("Школа", 1.5,
 
-    near_school = nearest_dist("Школа")
+         ("Школа рядом — лучше доступность.", None),
 
-    near_park = nearest_dist("Парк")
+         (None, "Школа далеко — увеличится нагрузка на транспорт."),
 
-    near_ind = nearest_dist("Промышленный объект")
- 
-    if not objs:
+         (None, "Поблизости нет школ — возможна перегрузка инфраструктуры.")),
 
-        plus.append("Это первая точка — удобно начать моделирование с базы района.")
+        ("Парк", 1.2,
 
-        return plus, minus
- 
-    if obj_type == "Жилой комплекс":
+         ("Рядом парк — выше комфорт и качество среды.", None),
 
-        if near_school is None:
+         (None, "Нет парка рядом — стоит добавить зелёную зону."),
 
-            minus.append("Поблизости нет школ — возможна перегрузка инфраструктуры.")
+         None),
 
-        elif near_school <= 1.5:
+        ("Промышленный объект", 2.0,
 
-            plus.append("Школа рядом — лучше доступность.")
+         (None, "Слишком близко к промзоне — риск хуже по экологии."),
 
-        else:
+         ("Далеко от промзоны — лучше по экологии.", None),
 
-            minus.append("Школа далеко — увеличится нагрузка на транспорт.")
- 
-        if near_park is not None and near_park <= 1.2:
+         None),
 
-            plus.append("Рядом парк — выше комфорт и качество среды.")
+    ),
 
-        else:
+    "Школа": (
 
-            minus.append("Нет парка рядом — стоит добавить зелёную зону.")
- 
-        if near_ind is not None and near_ind <= 2.0:
+        ("Жилой комплекс", 1.5,
 
-            minus.append("Слишком близко к промзоне — риск хуже по экологии.")
+         ("Рядом жильё — школа будет востребована и удобна.", None),
 
-        else:
+         (None, "Жильё далеко — детям придётся ездить, вырастет трафик."),
 
-            plus.append("Далеко от промзоны — лучше по экологии.")
- 
-    elif obj_type == "Школа":
+         (None, "Нет жилья рядом — школа может быть “в пустоте”.")),
 
-        if near_home is None:
+        ("Промышленный объект", 2.5,
 
-            minus.append("Нет жилья рядом — школа может быть “в пустоте”.")
+         (None, "Близко к промзоне — нежелательно для школьной среды."),
 
-        elif near_home <= 1.5:
+         ("Подальше от промзоны — лучше для здоровья и комфорта.", None),
 
-            plus.append("Рядом жильё — школа будет востребована и удобна.")
+         None),
 
-        else:
+    ),
 
-            minus.append("Жильё далеко — детям придётся ездить, вырастет трафик.")
- 
-        if near_ind is not None and near_ind <= 2.5:
+    "Парк": (
 
-            minus.append("Близко к промзоне — нежелательно для школьной среды.")
+        ("Жилой комплекс", 1.5,
 
-        else:
+         ("Рядом жильё — парк даст максимальную пользу жителям.", None),
 
-            plus.append("Подальше от промзоны — лучше для здоровья и комфорта.")
- 
-    elif obj_type == "Парк":
+         ("Парк улучшит район, но рядом с жильём эффект сильнее.", None),
 
-        if near_home is not None and near_home <= 1.5:
+         None),
 
-            plus.append("Рядом жильё — парк даст максимальную пользу жителям.")
+        ("Промышленный объект", 2.0,
 
-        else:
+         ("Рядом промзона — парк частично компенсирует влияние загрязнения.", "Но шум/выбросы всё равно могут ощущаться."),
 
-            plus.append("Парк улучшит район, но рядом с жильём эффект сильнее.")
- 
-        if near_ind is not None and near_ind <= 2.0:
+         ("Чистая зона — парк усилит комфорт и привлекательность.", None),
 
-            plus.append("Рядом промзона — парк частично компенсирует влияние загрязнения.")
+         None),
 
-            minus.append("Но шум/выбросы всё равно могут ощущаться.")
+    ),
 
-        else:
+    "Промышленный объект": (
+
+        ("Жилой комплекс", 3.0,
+
+         (None, "Близко к жилью — риски по экологии и жалобы жителей."),
+
+         ("Далеко от жилья — меньше конфликтов по экологии.", None),
+
+         None),
+
+        ("Школа", 3.5,
+
+         (None, "Близко к школе — нежелательное соседство."),
+
+         ("Далеко от школ — лучше для социальной среды.", None),
+
+         None),
+
+        (None, 0.0,
+
+         ("Плюс: рабочие места и экономическая активность.", "Минус: ухудшает качество воздуха вокруг (если нет фильтров)."),
+
+         None,
+
+         None),
+
+    ),
+
+    "Спорткомплекс": (
+
+        ("Жилой комплекс", 2.0,
+
+         ("Рядом жильё — удобный доступ для посетителей.", None),
+
+         (None, "Далеко от жилья — посещаемость может быть ниже."),
+
+         None),
+
+        ("Парк", 1.5,
+
+         ("Рядом парк — хорошая связка для спорта и отдыха.", None),
+
+         ("Можно дополнить рядом парком для комфорта.", None),
+
+         None),
+
+    ),
+
+    "Мост": (
+
+        (None, 0.0,
 
-            plus.append("Чистая зона — парк усилит комфорт и привлекательность.")
+         ("Мост улучшает связанность и снижает объезды.", "Если нет разрыва маршрутов, эффект может быть слабее (в MVP упрощено)."),
+
+         None,
+
+         None),
+
+    ),
+
+}
+
+# какие расстояния nearest_dist() реально нужны для каждого типа
+
+NEEDED = {t: tuple(dict.fromkeys(r[0] for r in rules if r[0] is not None)) for t, rules in RULES.items()}
+ 
  
-    elif obj_type == "Промышленный объект":
+def evaluate_location(obj_type: str, lat: float, lon: float, objs: List[CityObject], exclude_id: Optional[str] = None) -> Tuple[List[str], List[str]]:
 
-        if near_home is not None and near_home <= 3.0:
+    return _evaluate_location_cached(obj_type, lat, lon, spatial_index(objs)["key"], exclude_id, objs)
+ 
+ 
+# _objs не хэшируется: кэш различает объекты по objs_key, пересчёт — только после add/move/delete
 
-            minus.append("Близко к жилью — риски по экологии и жалобы жителей.")
+@st.cache_data(max_entries=256, show_spinner=False)
 
-        else:
+def _evaluate_location_cached(obj_type: str, lat: float, lon: float, objs_key: bytes, exclude_id: Optional[str], _objs: List[CityObject]) -> Tuple[List[str], List[str]]:
 
-            plus.append("Далеко от жилья — меньше конфликтов по экологии.")
+    objs = _objs
+
+    plus, minus = [], []
+
+    index = spatial_index(objs)
+
+    ex = objs[index["pos"][exclude_id]] if exclude_id in index["pos"] else None
+
+    x, y = project_km(lat, lon)
  
-        if near_school is not None and near_school <= 3.5:
+    def nearest_dist(t: str):
 
-            minus.append("Близко к школе — нежелательное соседство.")
+        # только объекты нужного типа (корзина), а не весь список
 
-        else:
+        xy = index["by_type"][t]
+
+        d = np.hypot(xy[:, 0] - x, xy[:, 1] - y)
+
+        if ex is not None and ex.obj_type == t:
+
+            d = np.delete(d, ex.index_in_bucket)  # сам оцениваемый объект не считается соседом
 
-            plus.append("Далеко от школ — лучше для социальной среды.")
+        return float(d.min()) if d.size else None
  
-        plus.append("Плюс: рабочие места и экономическая активность.")
+    if not objs or (len(objs) == 1 and ex is not None):
 
-        minus.append("Минус: ухудшает качество воздуха вокруг (если нет фильтров).")
+        plus.append("Это первая точка — удобно начать моделирование с базы района.")
+
+        return plus, minus
  
-    elif obj_type == "Спорткомплекс":
+    nears = {t: nearest_dist(t) for t in NEEDED.get(obj_type, ())}
 
-        if near_home is not None and near_home <= 2.0:
+    for other, thr, near, far, missing in RULES.get(obj_type, ()):
 
-            plus.append("Рядом жильё — удобный доступ для посетителей.")
+        d = nears.get(other)
 
-        else:
+        if other is None or (d is not None and d <= thr):
 
-            minus.append("Далеко от жилья — посещаемость может быть ниже.")
- 
-        if near_park is not None and near_park <= 1.5:
+            good, bad = near
+
+        elif d is None and missing is not None:
 
-            plus.append("Рядом парк — хорошая связка для спорта и отдыха.")
+            good, bad = missing
 
         else:
 
-            plus.append("Можно дополнить рядом парком для комфорта.")
- 
-    elif obj_type == "Мост":
+            good, bad = far
+
+        if good:
+
+            plus.append(good)
 
-        plus.append("Мост улучшает связанность и снижает объезды.")
+        if bad:
 
-        minus.append("Если нет разрыва маршрутов, эффект может быть слабее (в MVP упрощено).")
+            minus.append(bad)
  
     if not plus:
 
@@ -358,39 +546,66 @@ def evaluate_location(obj_type: str, lat: float, lon: float, objs: List[CityObje
  
 def analyze_perimeter(lat: float, lon: float, objs: List[CityObject], radius_km: float = ANALYSIS_RADIUS_KM) -> Dict:
 
-    around = []
+    # тот же запрос, что и в прошлый прогон (пан/зум карты), — без хэширования ключа и распаковки из st.cache_data
 
-    for o in objs:
+    query = (round(lat, 6), round(lon, 6), st.session_state.objects_version, radius_km)
 
-        d = haversine_km(lat, lon, o.lat, o.lon)
+    last = st.session_state.perimeter_cache
 
-        if d <= radius_km:
+    if last is not None and last[0] == query:
 
-            around.append((o, d))
+        return last[1]
  
-    counts = {}
+    result = _analyze_perimeter_cached(lat, lon, spatial_index(objs)["key"], radius_km, objs)
+
+    # в кэше лежат id (CityObject из скрипта не сериализуется), объекты подставляем здесь
 
-    for o, _d in around:
+    result["nearest"] = [(st.session_state.objects_by_id[oid], d) for oid, d in result["nearest"]]
 
-        counts[o.obj_type] = counts.get(o.obj_type, 0) + 1
+    st.session_state.perimeter_cache = (query, result)
+
+    return result
+ 
  
-    # Оставляем только то, что ты хотела: без “жителей” и “вместимость школ”
+@st.cache_data(max_entries=256, show_spinner=False)
 
-    industry_emission = sum(
+def _analyze_perimeter_cached(lat: float, lon: float, objs_key: bytes, radius_km: float, _objs: List[CityObject]) -> Dict:
 
-        float(o.params.get("emission", 0)) * (1.0 - float(o.params.get("filters_eff", 0)))
+    objs = _objs
+
+    index = spatial_index(objs)
+
+    arrs = index["arrs"]
+ 
+    # KD-дерево отбирает кандидатов по проекции (без тригонометрии),
+
+    # Numba-ядро за один проход считает по ним точный haversine и индикаторы
+
+    cand = np.array(index["tree"].query_ball_point(project_km(lat, lon), r=radius_km, return_sorted=True), dtype=np.intp)
+
+    # Оставляем только то, что ты хотела: без “жителей” и “вместимость школ” (передаём нули)
+
+    zeros = np.zeros(len(cand))
 
-        for o, _d in around
+    type_counts, _res, _cap, industry_emission, idx_sorted, d_sorted = perimeter(
 
-        if o.obj_type == "Промышленный объект"
+        arrs["lat_rad"][cand], arrs["lon_rad"][cand], arrs["cos_lat"][cand], arrs["type_code"][cand],
+
+        zeros, zeros, arrs["emission_eff"][cand],
+
+        lat, lon, radius_km, len(TYPE_NAMES), NEAREST_SHOWN,
 
     )
 
+    nearest = [(objs[cand[k]].id, float(d)) for k, d in zip(idx_sorted, d_sorted)]
+ 
+    counts = {TYPE_NAMES[code]: int(c) for code, c in enumerate(type_counts) if c}
+
     parks = counts.get("Парк", 0)
  
     return {
 
-        "around": sorted(around, key=lambda x: x[1]),
+        "nearest": nearest,
 
         "counts": counts,
 
@@ -444,6 +659,18 @@ def init_state():
 
         st.session_state.objects = []
 
+    if "obj_arr" not in st.session_state:
+
+        st.session_state.obj_arr = np.empty(0, dtype=OBJ_DTYPE)
+
+    if "objects_by_id" not in st.session_state:
+
+        st.session_state.objects_by_id = {}
+
+    if "objects_by_type" not in st.session_state:
+
+        st.session_state.objects_by_type = {t: [] for t in DEFAULT_PARAMS}
+
     if "mode" not in st.session_state:
 
         st.session_state.mode = "Добавить"
@@ -463,6 +690,26 @@ def init_state():
     if "map_selected_id" not in st.session_state:
 
         st.session_state.map_selected_id = None
+
+    if "kdtree" not in st.session_state:
+
+        st.session_state.kdtree = None
+
+    if "objects_version" not in st.session_state:
+
+        st.session_state.objects_version = 0
+
+    if "next_id" not in st.session_state:
+
+        st.session_state.next_id = 0
+
+    if "perimeter_cache" not in st.session_state:
+
+        st.session_state.perimeter_cache = None
+
+    if "map_cache" not in st.session_state:
+
+        st.session_state.map_cache = None
  
  
 def add_object(obj_type: str, lat: float, lon: float):
@@ -483,9 +730,40 @@ def add_object(obj_type: str, lat: float, lon: float):
 
     st.session_state.objects.append(o)
 
+    st.session_state.objects_by_id[o.id] = o
+
+    arr = np.resize(st.session_state.obj_arr, len(st.session_state.obj_arr) + 1)
+
+    arr[-1] = object_record(o)
+
+    st.session_state.obj_arr = arr
+
+    bucket = st.session_state.objects_by_type[obj_type]
+
+    o.index_in_bucket = len(bucket)
+
+    bucket.append(o)
+
     st.session_state.selected_id = o.id
 
     st.session_state.map_selected_id = None
+
+    st.session_state.objects_version += 1
+ 
+ 
+def remove_from_bucket(o: CityObject):
+
+    # O(1): на место удаляемого ставим последний объект корзины
+
+    bucket = st.session_state.objects_by_type[o.obj_type]
+
+    last = bucket.pop()
+
+    if last is not o:
+
+        bucket[o.index_in_bucket] = last
+
+        last.index_in_bucket = o.index_in_bucket
  
  
 def delete_selected():
@@ -496,11 +774,25 @@ def delete_selected():
 
         return
 
-    st.session_state.objects = [o for o in st.session_state.objects if o.id != sid]
+    o = st.session_state.objects_by_id.pop(sid, None)
+
+    if o is None:
+
+        return
+
+    remove_from_bucket(o)
+
+    # dict хранит порядок вставки — список пересобирается без сравнения id
+
+    st.session_state.objects = list(st.session_state.objects_by_id.values())
+
+    st.session_state.obj_arr = st.session_state.obj_arr[st.session_state.obj_arr["id"] != sid]
 
     st.session_state.selected_id = st.session_state.objects[0].id if st.session_state.objects else None
 
     st.session_state.map_selected_id = None
+
+    st.session_state.objects_version += 1
  
  
 def move_selected(lat: float, lon: float):
@@ -511,28 +803,208 @@ def move_selected(lat: float, lon: float):
 
         return
 
-    for o in st.session_state.objects:
+    o = st.session_state.objects_by_id.get(sid)
+
+    if o is None:
+
+        return
+
+    o.lat, o.lon = float(lat), float(lon)
 
-        if o.id == sid:
+    arr = st.session_state.obj_arr
 
-            o.lat, o.lon = float(lat), float(lon)
+    arr[arr["id"] == sid] = object_record(o)
 
-            st.session_state.map_selected_id = None
+    st.session_state.map_selected_id = None
 
-            return
+    st.session_state.objects_version += 1
  
  
 def get_selected_obj() -> Optional[CityObject]:
 
-    sid = st.session_state.selected_id
+    return st.session_state.objects_by_id.get(st.session_state.selected_id)
+ 
+ 
+# -----------------------------
 
-    for o in st.session_state.objects:
+# Map (cached per session)
 
-        if o.id == sid:
+# -----------------------------
 
-            return o
+# стили маркеров для JS-колбэка FastMarkerCluster (индекс — TYPE_CODES);
 
-    return None
+# обычные объекты — CircleMarker на canvas, иконка Font Awesome только у выбранного (selection_layer)
+
+MARKER_STYLES = [
+
+    dict(MAP_STYLE.get(t, {"color": "cadetblue", "fa": "info-sign"}), label=f"{emoji_for_type(t)} {t}")
+
+    for t in TYPE_NAMES
+
+]
+
+MARKER_CALLBACK = """function (row) {
+
+    var s = %s[row[2]];
+
+    var marker = L.circleMarker(new L.LatLng(row[0], row[1]), {
+
+        radius: 7, color: "#ffffff", weight: 1.5, fillColor: s.color, fillOpacity: 0.9,
+
+        bubblingMouseEvents: false  // клик по объекту не должен долетать до карты (last_clicked)
+
+    });
+
+    marker.bindTooltip(s.label, {sticky: true});
+
+    marker.bindPopup(s.label + "<br>id: " + row[3] + "<br>" + row[0].toFixed(5) + ", " + row[1].toFixed(5), {maxWidth: 300});
+
+    return marker;
+
+}""" % json.dumps(MARKER_STYLES, ensure_ascii=False)
+ 
+ 
+def build_map(objs: List[CityObject]) -> folium.Map:
+
+    m = folium.Map(location=DEFAULT_CENTER, zoom_start=MAP_ZOOM_START, control_scale=True, prefer_canvas=True)
+ 
+    # маркеры строятся в браузере из одного массива строк [lat, lon, код типа, id]
+
+    # вместо Jinja-шаблона на каждый folium.Marker; кластеры — только при отдалении от стартового
+
+    # масштаба, иначе при открытии соседние объекты (радиус кластера ~1 км) сливались в пузыри
+
+    data = [[o.lat, o.lon, TYPE_CODES[o.obj_type], o.id] for o in objs]
+
+    FastMarkerCluster(data, callback=MARKER_CALLBACK, disableClusteringAtZoom=MAP_ZOOM_START).add_to(m)
+
+    return m
+ 
+ 
+def get_map() -> folium.Map:
+
+    # карта кэшируется в сессии (st_folium меняет переданную карту, поэтому не st.cache_resource)
+
+    # и пересобирается только после добавления/перемещения/удаления объектов
+
+    cached = st.session_state.map_cache
+
+    if cached is None or cached[0] != st.session_state.objects_version:
+
+        m = build_map(st.session_state.objects)
+
+        # st_folium при первом вызове переименовывает элементы карты, и строка скрипта (а с ней ключ
+
+        # компонента) менялась между первым и вторым прогоном — переименовываем сразу, до рендера
+
+        generate_leaflet_string(m)
+
+        # полный Jinja-рендер фигуры — один раз на версию; st_folium дальше вызывается с render=False
+
+        m.get_root().render()
+
+        cached = (st.session_state.objects_version, m)
+
+        st.session_state.map_cache = cached
+
+    return cached[1]
+ 
+ 
+def selection_layer(o: Optional[CityObject]) -> folium.FeatureGroup:
+
+    # подсветка выбора — отдельным слоем поверх закэшированной карты
+
+    fg = folium.FeatureGroup(name="selection")
+
+    if o:
+
+        ring = folium.CircleMarker(
+
+            location=[o.lat, o.lon], radius=22, color="#111827", weight=2, fill=False
+
+        )
+
+        # на canvas кольцо ловило бы клики всем диском; folium не передаёт interactive, задаём напрямую
+
+        ring.options["interactive"] = False
+
+        ring.add_to(fg)
+
+        style = MAP_STYLE.get(o.obj_type, {"color": "cadetblue", "fa": "info-sign"})
+
+        label = f"{emoji_for_type(o.obj_type)} {o.obj_type}"
+
+        folium.Marker(
+
+            location=[o.lat, o.lon],
+
+            popup=folium.Popup(f"{label}<br>id: {o.id}<br>{o.lat:.5f}, {o.lon:.5f}", max_width=300),
+
+            tooltip=label,
+
+            icon=folium.Icon(color=style["color"], icon=style["fa"], prefix="fa"),
+
+        ).add_to(fg)
+
+    # стабильные id вместо случайных: тот же выбор даёт ту же строку слоя,
+
+    # и фронтенд не пересоздаёт слой и обработчики кликов на каждом прогоне
+
+    stable_ids(fg, "selection")
+
+    return fg
+ 
+ 
+def stable_ids(el, prefix: str):
+
+    # дочерние элементы, а также части header/html/script (например, Html внутри Popup)
+
+    parts = [el] + [getattr(el, a) for a in ("header", "html", "script") if isinstance(getattr(el, a, None), folium.Element)]
+
+    n = 0
+
+    for part in parts:
+
+        # ключи словаря — имена на момент добавления, шаблоны (Popup) берут имя оттуда
+
+        children = list(part._children.values())
+
+        part._children.clear()
+
+        for child in children:
+
+            child._id = f"{prefix}_{n}"
+
+            stable_ids(child, child._id)
+
+            part._children[child.get_name()] = child
+
+            n += 1
+ 
+ 
+def st_folium_with_layer(m: folium.Map, layer: folium.FeatureGroup, **kwargs) -> Dict:
+
+    # st_folium прикрепляет слой к закэшированной карте и рендерит его скрипты в фигуру —
+
+    # после вызова убираем и то и другое, чтобы карта осталась базовой
+
+    root = m.get_root()
+
+    figure_parts = (root.header, root.html, root.script)
+
+    before = [set(part._children) for part in figure_parts]
+
+    st_map = st_folium(m, feature_group_to_add=layer, render=False, **kwargs)  # карта уже отрендерена в get_map()
+
+    m._children.pop(layer.get_name(), None)
+
+    for part, keys in zip(figure_parts, before):
+
+        for name in set(part._children) - keys:
+
+            del part._children[name]
+
+    return st_map
  
  
 # -----------------------------
@@ -709,7 +1181,7 @@ with left:
 
         if sel:
 
-            p, m = evaluate_location(sel.obj_type, sel.lat, sel.lon, [o for o in st.session_state.objects if o.id != sel.id])
+            p, m = evaluate_location(sel.obj_type, sel.lat, sel.lon, st.session_state.objects, exclude_id=sel.id)
 
             st.markdown(f"**Выбран:** {emoji_for_type(sel.obj_type)} {sel.obj_type}")
 
@@ -727,13 +1199,15 @@ with left:
 
             p, m = (["Выберите объект или кликните по карте, чтобы получить оценку."], [])
  
-        for s in p:
+        # все плюсы/минусы — одним элементом, а не отдельным st.markdown на строку
 
-            st.markdown(f'<div class="pm-plus">+ {s}</div>', unsafe_allow_html=True)
+        st.markdown(
+
+            "".join([f'<div class="pm-plus">+ {s}</div>' for s in p] + [f'<div class="pm-minus">– {s}</div>' for s in m]),
 
-        for s in m:
+            unsafe_allow_html=True
 
-            st.markdown(f'<div class="pm-minus">– {s}</div>', unsafe_allow_html=True)
+        )
  
         st.markdown("</div>", unsafe_allow_html=True)
  
@@ -803,13 +1277,11 @@ with left:
 
             st.success(f"🌳 Парков в радиусе: **{result['parks']}** — это поддерживает экологию и комфорт.")
  
-        if result["around"]:
+        if result["nearest"]:
 
             st.caption("Ближайшие объекты:")
 
-            for o, d in result["around"][:6]:
-
-                st.write(f"- {emoji_for_type(o.obj_type)} {o.obj_type} — **{d:.2f} км**")
+            st.write("\n".join(f"- {emoji_for_type(o.obj_type)} {o.obj_type} — **{d:.2f} км**" for o, d in result["nearest"]))
  
         st.markdown("</div>", unsafe_allow_html=True)
  
@@ -869,37 +1341,17 @@ with right:
  
     # Карта
 
-    m = folium.Map(location=DEFAULT_CENTER, zoom_start=13, control_scale=True)
- 
-    # Маркеры с цветами
+    m = get_map()
 
-    for o in st.session_state.objects:
+    highlight = selection_layer(sel)
 
-        style = MAP_STYLE.get(o.obj_type, {"color": "cadetblue", "fa": "info-sign"})
-
-        popup = (
-
-            f"{emoji_for_type(o.obj_type)} {o.obj_type}<br>"
+    st_map = st_folium_with_layer(
 
-            f"id: {o.id}<br>"
+        m, highlight, height=680, width=None, key="map",
 
-            f"{o.lat:.5f}, {o.lon:.5f}"
-
-        )
+        returned_objects=["last_clicked", "last_object_clicked"],
 
-        folium.Marker(
-
-            location=[o.lat, o.lon],
-
-            popup=folium.Popup(popup, max_width=300),
-
-            tooltip=f"{emoji_for_type(o.obj_type)} {o.obj_type}",
-
-            icon=folium.Icon(color=style["color"], icon=style["fa"], prefix="fa"),
-
-        ).add_to(m)
- 
-    st_map = st_folium(m, height=680, width=None)
+    )
  
     # Клик по маркеру -> выбираем объект и показываем мини-окно действий
 
@@ -0,0 +1,49 @@
+import math
+
+import numpy as np
+from numba import njit
+
+
+# -----------------------------
+# Числовые ядра (Numba): только скалярные числа и массивы, без str/dict
+# -----------------------------
+@njit(fastmath=True, cache=True)
+def hv_pre(p1, l1, cos1, p2, l2, cos2):
+    # координаты уже в радианах, косинусы широт посчитаны заранее
+    R = 6371.0
+    a = math.sin((p2 - p1) / 2) ** 2 + cos1 * cos2 * math.sin((l2 - l1) / 2) ** 2
+    return 2 * R * math.asin(math.sqrt(a))
+
+
+# без parallel=True: Streamlit зовёт ядро из потоков разных сессий одновременно, а слой
+# потоков workqueue не потокобезопасен; к тому же на вход приходят только кандидаты
+# из KD-дерева в радиусе — это десятки строк
+@njit(fastmath=True, cache=True)
+def perimeter(lat_rad, lon_rad, cos_lat, types_int, residents, capacity, emission_eff, qlat, qlon, radius, n_types, k):
+    # один проход считает только расстояния (тригонометрия объектов передана готовой,
+    # здесь считается только для точки запроса); агрегаты — одной группировкой по маске радиуса
+    qp, ql = math.radians(qlat), math.radians(qlon)
+    qcos = math.cos(qp)
+    n = lat_rad.shape[0]
+    d = np.empty(n)
+    for i in range(n):
+        d[i] = hv_pre(qp, ql, qcos, lat_rad[i], lon_rad[i], cos_lat[i])
+
+    idx = np.nonzero(d <= radius)[0]
+    counts = np.zeros(n_types, dtype=np.int64)
+    by_type = np.bincount(types_int[idx].astype(np.int64))
+    counts[:by_type.shape[0]] = by_type
+    # атрибуты чужих типов равны 0, поэтому сумма по маске = сумма по своему типу
+    residents_sum = np.sum(residents[idx].astype(np.float64))
+    cap_sum = np.sum(capacity[idx].astype(np.float64))
+    emit_sum = np.sum(emission_eff[idx].astype(np.float64))
+
+    # k ближайших: частичный отбор через partition вместо сортировки всех объектов в радиусе;
+    # все равные k-му расстоянию остаются кандидатами, так что порядок совпадает с полной сортировкой
+    dw = d[idx]
+    if 0 < k < dw.shape[0]:
+        kth = np.partition(dw, k - 1)[k - 1]
+        idx = idx[dw <= kth]
+        dw = d[idx]
+    idx_sorted = idx[np.argsort(dw, kind="mergesort")[:k]]
+    return counts, residents_sum, cap_sum, emit_sum, idx_sorted, d[idx_sorted]